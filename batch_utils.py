@@ -0,0 +1,120 @@
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared file readers and batch runner for the MySQL and BigQuery importers
+# pip install pandas openpyxl
+
+
+def read_excel_chunks(excel_file):
+    """
+    Yield the first worksheet of an Excel file as a single DataFrame chunk.
+    pd.read_excel has no chunked mode, and building frames from raw cell values
+    would lose its type inference (e.g. numeric text cells read as integers).
+    """
+    yield pd.read_excel(excel_file)
+
+
+def read_csv_chunks(csv_file, chunk_size, **constant_columns):
+    """
+    Stream a CSV file as DataFrames of up to chunk_size rows,
+    adding any constant_columns to every chunk.
+    """
+    for chunk in pd.read_csv(csv_file, chunksize=chunk_size):
+        yield chunk.assign(**constant_columns)
+
+
+def cast_chunk(chunk, source_dtypes):
+    """
+    Cast a raw chunk to the dtypes the first raw chunk of the same load was read
+    with, so its columns go through the same conversion. Only integers read into
+    a float column are cast; conform_chunk deals with any other difference.
+    """
+    if list(chunk.columns) != list(source_dtypes):
+        raise ValueError(
+            f"Chunk columns {list(chunk.columns)} don't match the first chunk's {list(source_dtypes)}"
+        )
+
+    for column, source in source_dtypes.items():
+        col = chunk[column]
+        if pd.api.types.is_float_dtype(source) and pd.api.types.is_integer_dtype(col.dtype):
+            chunk[column] = col.astype(source)
+
+    return chunk
+
+
+def _nullable_dtype(dtype):
+    """
+    Return a dtype like dtype that can hold missing values.
+    """
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'boolean'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'Int64'
+    return dtype
+
+
+def conform_chunk(df, column_dtypes):
+    """
+    Cast a converted chunk to the dtypes of the first converted chunk of the same
+    load, which the table schema was created from. Columns that are all null in
+    this chunk become nulls of the schema's dtype, integers widen to nullable
+    Int64, integers to floats, and anything to strings for string columns;
+    any other mismatch raises ValueError instead of loading mistyped values.
+    """
+    if list(df.columns) != list(column_dtypes):
+        raise ValueError(
+            f"Chunk columns {list(df.columns)} don't match the first chunk's {list(column_dtypes)}"
+        )
+
+    for column, target in column_dtypes.items():
+        col = df[column]
+        actual = col.dtype
+        if actual == target:
+            continue
+
+        if col.isna().all():
+            # Optional columns are often empty for a whole chunk; string columns
+            # render their nulls the way the first chunk's conversion does
+            if pd.api.types.is_object_dtype(target):
+                df[column] = col.astype(str)
+            else:
+                df[column] = col.astype(_nullable_dtype(target))
+        elif pd.api.types.is_integer_dtype(target) and pd.api.types.is_integer_dtype(actual):
+            df[column] = col.astype('Int64')
+        elif pd.api.types.is_float_dtype(target) and (
+            pd.api.types.is_integer_dtype(actual) or pd.api.types.is_float_dtype(actual)
+        ):
+            df[column] = col.astype(target)
+        elif pd.api.types.is_object_dtype(target):
+            df[column] = col.astype(str).where(col.notna(), None)
+        else:
+            raise ValueError(
+                f"Column {column!r} was {target} in the first chunk but {actual} in a later one; "
+                f"increase the read chunk size or clean the column so the whole file has one type"
+            )
+
+    return df
+
+
+def import_files(jobs, import_file, max_workers, serialize_tables=True):
+    """
+    Call import_file(table_name, file_path, chunks) for every job, running
+    different tables in parallel. Files that target the same table are imported
+    in order on one worker so they don't race on table creation or id assignment,
+    unless serialize_tables is False because the database handles both itself.
+    """
+    if not serialize_tables:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda job: import_file(*job), jobs))  # Re-raises worker errors
+        return
+
+    files_by_table = {}
+    for table_name, file_path, chunks in jobs:
+        files_by_table.setdefault(table_name, []).append((file_path, chunks))
+
+    def import_table(table_name):
+        for file_path, chunks in files_by_table[table_name]:
+            import_file(table_name, file_path, chunks)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(import_table, files_by_table))  # Re-raises worker errors
@@ -1,71 +1,154 @@
 from google.cloud import bigquery
 from google.oauth2 import service_account
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import functools
+import io
 import os
 from datetime import datetime
+from batch_utils import cast_chunk, conform_chunk, import_files, read_csv_chunks, read_excel_chunks
 
 # pip install pandas openpyxl
 
+# Only columns that are actually modified get copied (pandas >= 2.0). Set once
+# here: the option is process-wide, so toggling it per call races across threads
+pd.set_option('mode.copy_on_write', True)
+
 # Google BigQuery Configuration
 GOOGLE_APPLICATION_CREDENTIALS = os.get('GOOGLE_APPLICATION_CREDENTIALS')
 GBQPROJECT_ID = os.get('GBQPROJECT_ID')
 GBQPROJECT_DATASET = os.get('GBQPROJECT_DATASET')
 
-def safe_convert_for_parquet(df):
+# Rows parsed per chunk when streaming CSV input
+READ_CHUNK_SIZE = 500000
+
+# Maximum rows per BigQuery load job. One job per read chunk keeps well under
+# the daily load-job quota (1,500 per table); frames larger than a chunk (whole
+# Excel sheets) are split so they still load as several concurrent jobs.
+LOAD_JOB_ROWS = READ_CHUNK_SIZE
+
+# Load jobs allowed in flight per import before waiting on the oldest
+MAX_PENDING_LOAD_JOBS = 10
+
+# Tables imported concurrently by batch_excel_to_bigquery
+MAX_IMPORT_WORKERS = 8
+
+# Table ids known to exist, so repeated loads skip the get_table() call
+KNOWN_TABLES = set()
+
+def _convert_float(df, column, sample_value):
+    # Vectorized whole-number check (NaN already dropped, inf is never integral)
+    values = df[column].dropna().to_numpy(dtype='float64')
+    if np.isfinite(values).all() and (np.mod(values, 1.0) == 0.0).all():
+        df[column] = df[column].astype('Int64')  # Nullable integer
+    else:
+        df[column] = df[column].astype(str)  # Convert float to string
+
+
+def _convert_object(df, column, sample_value):
+    # Handle lists, dicts, sets, tuples
+    if isinstance(sample_value, (list, dict, set, tuple)):
+        values = df[column].to_numpy()
+        missing = pd.isna(values)
+        converted = np.empty(len(values), dtype=object)  # Missing slots stay None
+        converted[~missing] = [str(v) for v in values[~missing]]
+        df[column] = converted
+
+    # Skip the full-column parse unless a sample of values looks like dates
+    sample_values = df[column].dropna().head(32).astype(str)
+    if not sample_values.str.match(r'\d{4}-\d{2}-\d{2}').any():
+        df[column] = df[column].astype(str)
+        return
+
+    # Convert to datetime if applicable (cache parses repeated strings once)
+    try:
+        converted_col = pd.to_datetime(df[column], format="%Y-%m-%d %H:%M:%S", errors='coerce', cache=True)
+        if converted_col.notna().sum() > 0:  # Check if valid datetime values exist
+            df[column] = converted_col.dt.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            df[column] = df[column].astype(str)  # Keep as string if all conversions failed
+    except Exception:
+        df[column] = df[column].astype(str)
+
+
+def _convert_datetime(df, column, sample_value):
+    # Format in NumPy's C code instead of a per-element strftime. Only naive
+    # datetime64 columns get here; tz-aware ones are stringified with their offset.
+    values = df[column].to_numpy(dtype='datetime64[s]')
+    formatted = np.char.replace(np.datetime_as_string(values, unit='s'), 'T', ' ').astype(object)
+    formatted[np.isnat(values)] = None
+    df[column] = formatted
+
+
+def _convert_timedelta(df, column, sample_value):
+    seconds = df[column].dt.total_seconds()
+    df[column] = seconds.astype(str).where(seconds.notna(), None)
+
+
+def _keep_as_is(df, column, sample_value):
+    pass  # Boolean and integer columns are already Parquet-compatible
+
+
+def _convert_to_string(df, column, sample_value):
+    df[column] = df[column].astype(str)
+
+
+# Converters keyed by numpy dtype kind, built once instead of probing
+# pd.api.types for every column
+PARQUET_CONVERTERS = {
+    'f': _convert_float,
+    'O': _convert_object,
+    'M': _convert_datetime,
+    'm': _convert_timedelta,
+    'b': _keep_as_is,
+    'i': _keep_as_is,
+    'u': _keep_as_is,
+}
+
+
+def safe_convert_for_parquet(df, column_dtypes=None):
     """
     Convert all columns to types compatible with Parquet/PyArrow.
+    column_dtypes holds the converted dtypes of the first chunk of a chunked load;
+    later chunks pass it so their columns are converted the same way.
     """
     for column in df.columns:
         try:
             # Get sample of non-null values
             sample = df[column].dropna().head(1)
             if len(sample) == 0:
-                df[column] = df[column].astype(str)
+                # Only the first chunk stringifies empty columns; in later chunks
+                # conform_chunk gives them the schema's dtype
+                if column_dtypes is None:
+                    df[column] = df[column].astype(str)
                 continue
 
             # Get column data type
             dtype = df[column].dtype
             sample_value = sample.iloc[0]
 
-            # Handle different data types
-            if pd.api.types.is_float_dtype(dtype):
-                if df[column].dropna().apply(lambda x: x.is_integer()).all():
-                    df[column] = df[column].astype('Int64')  # Nullable integer
-                else:
-                    df[column] = df[column].astype(str)  # Convert float to string
-
-            elif isinstance(dtype, pd.CategoricalDtype):  # FIXED: Use isinstance()
-                df[column] = df[column].astype(str)
-
-            elif pd.api.types.is_object_dtype(dtype):
-                # Handle lists, dicts, sets, tuples
-                if isinstance(sample_value, (list, dict, set, tuple)):
-                    df[column] = df[column].apply(lambda x: str(x) if x is not None else None)
-
-                # Convert to datetime if applicable
-                try:
-                    converted_col = pd.to_datetime(df[column], format="%Y-%m-%d %H:%M:%S", errors='coerce')
-                    if converted_col.notna().sum() > 0:  # Check if valid datetime values exist
-                        df[column] = converted_col.dt.strftime('%Y-%m-%d %H:%M:%S')
-                    else:
-                        df[column] = df[column].astype(str)  # Keep as string if all conversions failed
-                except Exception:
-                    df[column] = df[column].astype(str)
-
-            elif pd.api.types.is_datetime64_dtype(dtype):
-                df[column] = df[column].dt.strftime('%Y-%m-%d %H:%M:%S')
-
-            elif pd.api.types.is_timedelta64_dtype(dtype):
-                df[column] = df[column].apply(lambda x: str(x.total_seconds()) if pd.notnull(x) else None)
-
-            elif pd.api.types.is_bool_dtype(dtype):
-                pass  # Keep boolean as is
-
-            elif pd.api.types.is_integer_dtype(dtype):
-                pass  # Keep integer as is
-
+            # Only plain NumPy dtypes go through the kind table; extension dtypes
+            # (categorical, tz-aware datetime, string, ...) can share a kind with
+            # a NumPy dtype but need different handling
+            if isinstance(dtype, np.dtype):
+                converter = PARQUET_CONVERTERS.get(dtype.kind, _convert_to_string)
+            elif isinstance(dtype, pd.CategoricalDtype):
+                converter = _convert_to_string
+            elif pd.api.types.is_float_dtype(dtype):
+                converter = _convert_float  # Nullable Float64
+            elif pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+                converter = _keep_as_is  # Nullable boolean/Int64
             else:
-                df[column] = df[column].astype(str)
+                converter = _convert_to_string
+
+            # Keep the first chunk's whole-number decision, so a float column
+            # stringified there isn't loaded as integers from later chunks
+            if (column_dtypes is not None and converter is _convert_float
+                    and not pd.api.types.is_integer_dtype(column_dtypes[column])):
+                converter = _convert_to_string
+            converter(df, column, sample_value)
 
         except Exception as e:
             print(f"Warning: Error converting column {column}. Converting to string. Error: {str(e)}")
@@ -90,86 +173,218 @@ def get_bigquery_type(pandas_dtype):
         return "STRING"
 
 
-def insert_database(table_name, data_frame):
+def prepare_data_frame(data_frame, column_dtypes=None):
+    """
+    Drop unnamed columns and convert the rest to Parquet-compatible types.
+    Later chunks of a chunked load pass the first chunk's converted column_dtypes.
+    """
+    # Clean unnamed columns with a plain boolean mask (no regex engine).
+    # Copy-on-write keeps later column assignments off the original DataFrame
+    # without copying it up front.
+    keep = ['unnamed' not in str(col).lower() for col in data_frame.columns]
+    df = data_frame.loc[:, keep]
+
+    # Convert all columns to Parquet-compatible types
+    return safe_convert_for_parquet(df, column_dtypes)
+
+
+@functools.lru_cache(maxsize=None)
+def get_bq_client():
+    """
+    Return the process-wide BigQuery client, creating it on first use.
+    """
+    return bigquery.Client.from_service_account_json(GOOGLE_APPLICATION_CREDENTIALS)
+
+
+def ensure_table(bq_client, table_id, df):
+    """
+    Create the BigQuery table from the DataFrame's schema if it does not exist yet.
+    Returns True when the table was created by this call.
+    """
+    # Skip the metadata round-trip for tables already seen by this process
+    if table_id in KNOWN_TABLES:
+        return False
+
     try:
-        # Create a copy to avoid modifying the original DataFrame
-        df = data_frame.copy()
+        # Check if the table exists
+        bq_client.get_table(table_id)
+        KNOWN_TABLES.add(table_id)
+        return False
+    except Exception:
+        # Table doesn't exist, create it with schema
+        schema = [
+            bigquery.SchemaField(col, get_bigquery_type(df[col].dtype))
+            for col in df.columns
+        ]
+
+        # Add an auto-incrementing ID column
+        schema.insert(0, bigquery.SchemaField("id", "INTEGER", mode="REQUIRED"))
+
+        # Add created_at timestamp column
+        schema.append(bigquery.SchemaField(
+            "created_at", "TIMESTAMP", mode="REQUIRED",
+            default_value_expression="CURRENT_TIMESTAMP()"
+        ))
+
+        # Create the table
+        table = bigquery.Table(table_id, schema=schema)
+        bq_client.create_table(table)
+        KNOWN_TABLES.add(table_id)
+        return True
+
+
+def fetch_next_id(bq_client, table_id):
+    """
+    Return the id following the current maximum id in the table.
+    """
+    query = f"SELECT IFNULL(MAX(id), 0) FROM `{table_id}`"
+    query_job = bq_client.query(query)
+    max_id = list(query_job.result())[0][0]  # Extract the max id
+    return max_id + 1
 
-        # Clean unnamed columns
-        df.drop(
-            df.columns[df.columns.str.contains('unnamed', case=False)],
-            axis=1, inplace=True
-        )
 
-        # Convert all columns to Parquet-compatible types
-        df = safe_convert_for_parquet(df)
+def delete_rows_between(bq_client, table_id, first_id, last_id):
+    """
+    Delete the rows with ids first_id to last_id, undoing a partially loaded import
+    without touching rows other writers appended to the table.
+    """
+    query = f"DELETE FROM `{table_id}` WHERE id BETWEEN {first_id} AND {last_id}"
+    bq_client.query(query).result()
 
-        # Create BigQuery client
-        bq_client = bigquery.Client.from_service_account_json(GOOGLE_APPLICATION_CREDENTIALS)
+
+def append_rows(bq_client, table_id, df, next_id, jobs):
+    """
+    Assign sequential ids starting at next_id to the DataFrame rows and submit
+    load jobs for them without waiting, adding each to jobs as it is submitted.
+    Returns the id to use for the following rows; the caller waits for the jobs.
+    """
+    # Generate sequential IDs (already ascending, so no sort is needed)
+    df.insert(0, "id", range(next_id, next_id + len(df)))
+
+    # Configure load job
+    job_config = bigquery.LoadJobConfig(
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        source_format=bigquery.SourceFormat.PARQUET
+    )
+
+    # Convert to Arrow with PyArrow directly, skipping the client's own
+    # DataFrame conversion and schema probing. id must be non-nullable to match
+    # its REQUIRED mode, or BigQuery rejects the append as a mode change.
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    schema = schema.set(schema.get_field_index("id"), pa.field("id", pa.int64(), nullable=False))
+    arrow_table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+    # Submit one load job per zero-copy slice, so uploading the next slice
+    # overlaps with BigQuery ingesting the previous one
+    for offset in range(0, arrow_table.num_rows, LOAD_JOB_ROWS):
+        buffer = io.BytesIO()
+        pq.write_table(arrow_table.slice(offset, LOAD_JOB_ROWS), buffer)
+        buffer.seek(0)
+        jobs.append(bq_client.load_table_from_file(buffer, table_id, job_config=job_config))
+
+    return next_id + len(df)
+
+
+def wait_for_jobs(jobs):
+    """
+    Wait for every job to finish, then raise the first failure, if any.
+    """
+    first_error = None
+    for job in jobs:
+        try:
+            job.result()
+        except Exception as e:
+            first_error = first_error or e
+    if first_error is not None:
+        raise first_error
+
+
+def insert_chunks(table_name, chunks):
+    """
+    Insert an iterable of DataFrame chunks into one BigQuery table.
+    The schema is created from the first chunk and later chunks are cast to its
+    dtypes. Load jobs for earlier chunks keep running while later chunks are read
+    and converted. Each load job commits on its own, so if any chunk or job fails,
+    the remaining jobs are awaited and the ids this call assigned are deleted.
+    """
+    try:
+        # Reuse the shared BigQuery client
+        bq_client = get_bq_client()
 
         # Construct full table ID
         table_id = f"{GBQPROJECT_ID}.{GBQPROJECT_DATASET}.{table_name}"
 
+        total_rows = 0
+        first_id = last_id = None
+        pending_jobs = []
         try:
-            # Check if the table exists
-            bq_client.get_table(table_id)
+            for chunk_idx, chunk in enumerate(chunks):
+                if chunk_idx == 0:
+                    # Later chunks are read back to the source dtypes, converted the
+                    # same way and cast to the converted dtypes the schema is built from
+                    source_dtypes = chunk.dtypes.to_dict()
+                    df = prepare_data_frame(chunk)
+                    column_dtypes = df.dtypes.to_dict()
+                    created = ensure_table(bq_client, table_id, df)
+                    # Scan for the max id once per load; later chunks continue the sequence
+                    next_id = 1 if created else fetch_next_id(bq_client, table_id)
+                    first_id = next_id
+                else:
+                    df = prepare_data_frame(cast_chunk(chunk, source_dtypes), column_dtypes)
+                    df = conform_chunk(df, column_dtypes)
+                # Cover this chunk's ids before any of its jobs is submitted
+                last_id = next_id + len(df) - 1
+                next_id = append_rows(bq_client, table_id, df, next_id, pending_jobs)
+                total_rows += len(df)
+
+                # Bound the jobs in flight; the oldest ones are the likeliest done
+                while len(pending_jobs) > MAX_PENDING_LOAD_JOBS:
+                    pending_jobs.pop(0).result()
+
+            wait_for_jobs(pending_jobs)
         except Exception:
-            # Table doesn't exist, create it with schema
-            schema = [
-                bigquery.SchemaField(col, get_bigquery_type(df[col].dtype))
-                for col in df.columns
-            ]
-
-            # Add an auto-incrementing ID column
-            schema.insert(0, bigquery.SchemaField("id", "INTEGER", mode="REQUIRED"))
-
-            # Add created_at timestamp column
-            schema.append(bigquery.SchemaField(
-                "created_at", "TIMESTAMP", mode="REQUIRED",
-                default_value_expression="CURRENT_TIMESTAMP()"
-            ))
-
-            # Create the table
-            table = bigquery.Table(table_id, schema=schema)
-            bq_client.create_table(table)
-
-        # Fetch the current max ID
-        query = f"SELECT IFNULL(MAX(id), 0) FROM `{table_id}`"
-        query_job = bq_client.query(query)
-        max_id = list(query_job.result())[0][0]  # Extract the max id
-        df.insert(0, "id", range(max_id + 1, max_id + 1 + len(df)))  # Generate sequential IDs
-
-        # Sort DataFrame before inserting (ensures sequential order)
-        df = df.sort_values(by="id").reset_index(drop=True)
-        # Configure load job
-        job_config = bigquery.LoadJobConfig(
-            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
-            source_format=bigquery.SourceFormat.PARQUET
-        )
-
-        # Load DataFrame to BigQuery
-        job = bq_client.load_table_from_dataframe(df, table_id, job_config=job_config)
-        job.result()  # Wait for completion
-
-        return f"Successfully inserted {len(df)} rows into {table_name}"
+            # Let in-flight jobs settle so none writes after the cleanup, then
+            # undo the rows this call loaded
+            if last_id is not None and last_id >= first_id:
+                try:
+                    wait_for_jobs(pending_jobs)
+                except Exception:
+                    pass  # Already failing; the original error is re-raised below
+                try:
+                    delete_rows_between(bq_client, table_id, first_id, last_id)
+                except Exception as cleanup_error:
+                    print(f"Error: could not delete ids {first_id}-{last_id} from {table_id}: {str(cleanup_error)}")
+            raise
+
+        return f"Successfully inserted {total_rows} rows into {table_name}"
 
     except Exception as e:
         print(f"Error: {str(e)}")
         return e
-    
-    
-    
+
+
+def insert_database(table_name, data_frame):
+    return insert_chunks(table_name, [data_frame])
+
+
+def import_file(table_name, file_path, chunks):
+    """
+    Import one file's chunks into a BigQuery table.
+    """
+    return insert_chunks(table_name, chunks)
+
+
 # Read Excel file
 print("Current Working Directory:", os.getcwd())
 
 def batch_excel_to_bigquery(excel_files):
     try:
-        
+        jobs = []
         for excel_file in excel_files:
             table_name = os.path.splitext(excel_file)[0].replace('.xlsx', '')
 
-            data_frame = pd.read_excel(excel_file)
-            insert_database(table_name, data_frame)
+            jobs.append((table_name, excel_file, read_excel_chunks(excel_file)))
+        import_files(jobs, import_file, MAX_IMPORT_WORKERS)
     except Exception as e:
         print(e)
         
@@ -193,9 +408,9 @@ def batch_csv_to_bigquery(csv_files):
                 facility_name = 'Kensington'
             else:
                 facility_name = 'Gateway'
-            data_frame = pd.read_csv(csv_file)
-            data_frame['facility_name'] = facility_name
-            insert_database(table_name, data_frame)
+            chunks = read_csv_chunks(csv_file, READ_CHUNK_SIZE, facility_name=facility_name)
+            # Every file lands in the same table, so they are imported one at a time
+            insert_chunks(table_name, chunks)
     except Exception as e:
         print(e)
 
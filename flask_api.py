@@ -3,7 +3,10 @@ from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from flask_bcrypt import Bcrypt
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
 from dotenv import load_dotenv
+from sqlalchemy import bindparam, select
 from sqlalchemy.exc import IntegrityError
 
 # Load environment variables
@@ -18,11 +21,16 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
 )
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
+# bcrypt cost factor; every signup/login pays 2**rounds hashing iterations
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
 
 # Initialize extensions
 db = SQLAlchemy(app)
 jwt = JWTManager(app)
 bcrypt = Bcrypt(app)
+# Per-IP limits on the bcrypt-heavy routes so request bursts can't saturate workers
+limiter = Limiter(get_remote_address, app=app)
+AUTH_RATE_LIMIT = os.getenv('AUTH_RATE_LIMIT', '10 per minute')
 
 
 # Print out environment variables to debug
@@ -38,30 +46,35 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)
-    email = db.Column(db.String(255), nullable=False)
+    email = db.Column(db.String(255), nullable=False, unique=True, index=True)
     provider_id = db.Column(db.String(255), nullable=False)
     
 
-    def __init__(self, name, password,email,provider_id):
+    def __init__(self, name, password_hash, email, provider_id):
         self.name = name
-        self.password = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password = password_hash
         self.email = email
         self.provider_id = provider_id
 
+
+# Login lookup built once; SQLAlchemy reuses its compiled form from the statement cache
+LOGIN_STMT = select(User).where(User.email == bindparam('email'))
+
 # Signup Route
 @app.route('/signup', methods=['POST'])
+@limiter.limit(AUTH_RATE_LIMIT)
 def signup():
     data = request.json
     
-    # Validate input
-    if not data or 'name' not in data or 'password' not in data:
-        return jsonify({'message': 'Missing name or password'}), 400
+    # Validate all required fields before paying for the password hash
+    if not isinstance(data, dict) or not {'name', 'password', 'email', 'provider_id'} <= data.keys():
+        return jsonify({'message': 'Missing name, password, email or provider_id'}), 400
     
     try:
         # Create new user
         new_user = User(
             name=data['name'], 
-            password=data['password'],
+            password_hash=bcrypt.generate_password_hash(data['password']).decode('utf-8'),
             email=data['email'],
             provider_id=data['provider_id'],
         )
@@ -74,7 +87,7 @@ def signup():
     
     except IntegrityError:
         db.session.rollback()
-        return jsonify({'message': 'Username already exists'}), 409
+        return jsonify({'message': 'Username or email already exists'}), 409
     
     except Exception as e:
         db.session.rollback()
@@ -82,6 +95,7 @@ def signup():
 
 # Login Route
 @app.route('/login', methods=['POST'])
+@limiter.limit(AUTH_RATE_LIMIT)
 def login():
     try:
         data = request.json
@@ -90,8 +104,9 @@ def login():
         if not data or 'email' not in data or 'password' not in data:
             return jsonify({'message': 'Missing email or password'}), 400
         
-        # Find user by email
-        user = User.query.filter_by(email=data['email']).first()
+        # Find user by email; first() keeps working on databases that still hold
+        # duplicate emails from before the unique index
+        user = db.session.execute(LOGIN_STMT, {'email': data['email']}).scalars().first()
         
         # Check password
         if user and bcrypt.check_password_hash(user.password, data['password']):
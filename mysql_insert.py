@@ -1,76 +1,150 @@
 import pandas as pd
+import numpy as np
 import os
+import functools
+import tempfile
 import mysql.connector
 from mysql.connector import Error
 from datetime import datetime
+from batch_utils import cast_chunk, conform_chunk, import_files, read_csv_chunks, read_excel_chunks
 
 # pip install pandas openpyxl mysql-connector-python
 
 
+# Only columns that are actually modified get copied (pandas >= 2.0). Set once
+# here: the option is process-wide, so toggling it per call races across threads
+pd.set_option('mode.copy_on_write', True)
+
 MYSQL_CONFIG = {
     'host': os.get('MYSQL_HOST'),
     'user': os.get('MYSQL_USER'),
     'password': os.get('MYSQL_PASSWORD'),
-    'database': os.get('MYSQL_DATABASE')
+    'database': os.get('MYSQL_DATABASE'),
+    # LOAD DATA LOCAL INFILE may only read our own temp files, never arbitrary
+    # client files a server asks for
+    'allow_local_infile_in_path': tempfile.gettempdir()
+}
+
+# Server/client error codes raised when LOAD DATA LOCAL INFILE is disabled
+LOCAL_INFILE_REJECTED_ERRNOS = {1148, 2068, 3948}
+
+# ER_DUP_FIELDNAME: a concurrent import added the column first
+DUPLICATE_COLUMN_ERRNO = 1060
+
+# MySQL doesn't like certain characters in identifiers; str.translate maps
+# them all in a single pass
+IDENTIFIER_TRANSLATION = str.maketrans({' ': '_', '-': '_', '.': '_'})
+
+# Rows parsed per chunk when streaming CSV input
+READ_CHUNK_SIZE = 50000
+
+# Files imported concurrently by batch_excel_to_mysql and batch_csv_to_mysql
+MAX_IMPORT_WORKERS = 8
+
+def _convert_float(df, column, sample_value):
+    # Vectorized whole-number check (NaN already dropped, inf is never integral)
+    values = df[column].dropna().to_numpy(dtype='float64')
+    if np.isfinite(values).all() and (np.mod(values, 1.0) == 0.0).all():
+        df[column] = df[column].astype('Int64')  # Nullable integer
+    # Otherwise keep as float for MySQL DOUBLE type
+
+
+def _convert_object(df, column, sample_value):
+    # Handle lists, dicts, sets, tuples
+    if isinstance(sample_value, (list, dict, set, tuple)):
+        values = df[column].to_numpy()
+        missing = pd.isna(values)
+        converted = np.empty(len(values), dtype=object)  # Missing slots stay None
+        converted[~missing] = [str(v) for v in values[~missing]]
+        df[column] = converted
+
+    # Skip the full-column parse unless a sample of values looks like dates
+    sample_values = df[column].dropna().head(32).astype(str)
+    if not sample_values.str.match(r'\d{4}-\d{2}-\d{2}').any():
+        df[column] = df[column].astype(str)
+        return
+
+    # Convert to datetime if applicable (cache parses repeated strings once)
+    try:
+        converted_col = pd.to_datetime(df[column], format="%Y-%m-%d %H:%M:%S", errors='coerce', cache=True)
+        if converted_col.notna().sum() > 0:  # Check if valid datetime values exist
+            df[column] = converted_col.dt.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            df[column] = df[column].astype(str)  # Keep as string if all conversions failed
+    except Exception:
+        df[column] = df[column].astype(str)
+
+
+def _convert_datetime(df, column, sample_value):
+    # Format in NumPy's C code instead of a per-element strftime. Only naive
+    # datetime64 columns get here; tz-aware ones are stringified with their offset.
+    values = df[column].to_numpy(dtype='datetime64[s]')
+    formatted = np.char.replace(np.datetime_as_string(values, unit='s'), 'T', ' ').astype(object)
+    formatted[np.isnat(values)] = None
+    df[column] = formatted
+
+
+def _convert_timedelta(df, column, sample_value):
+    seconds = df[column].dt.total_seconds()
+    df[column] = seconds.astype(str).where(seconds.notna(), None)
+
+
+def _keep_as_is(df, column, sample_value):
+    pass  # Integers are kept as is; MySQL uses TINYINT(1) for boolean
+
+
+def _convert_to_string(df, column, sample_value):
+    df[column] = df[column].astype(str)
+
+
+# Converters keyed by numpy dtype kind, built once instead of probing
+# pd.api.types for every column
+MYSQL_CONVERTERS = {
+    'f': _convert_float,
+    'O': _convert_object,
+    'M': _convert_datetime,
+    'm': _convert_timedelta,
+    'b': _keep_as_is,
+    'i': _keep_as_is,
+    'u': _keep_as_is,
 }
 
-def safe_convert_for_mysql(df):
+
+def safe_convert_for_mysql(df, column_dtypes=None):
     """
     Convert all columns to types compatible with MySQL.
+    column_dtypes holds the converted dtypes of the first chunk of a chunked load;
+    later chunks pass it so their columns are converted the same way.
     """
     for column in df.columns:
         try:
             # Get sample of non-null values
             sample = df[column].dropna().head(1)
             if len(sample) == 0:
-                df[column] = df[column].astype(str)
+                # Only the first chunk stringifies empty columns; in later chunks
+                # conform_chunk gives them the schema's dtype
+                if column_dtypes is None:
+                    df[column] = df[column].astype(str)
                 continue
 
             # Get column data type
             dtype = df[column].dtype
             sample_value = sample.iloc[0]
 
-            # Handle different data types
-            if pd.api.types.is_float_dtype(dtype):
-                if df[column].dropna().apply(lambda x: x.is_integer()).all():
-                    df[column] = df[column].astype('Int64')  # Nullable integer
-                else:
-                    # Keep as float for MySQL DOUBLE type
-                    pass
-
+            # Only plain NumPy dtypes go through the kind table; extension dtypes
+            # (categorical, tz-aware datetime, string, ...) can share a kind with
+            # a NumPy dtype but need different handling
+            if isinstance(dtype, np.dtype):
+                converter = MYSQL_CONVERTERS.get(dtype.kind, _convert_to_string)
             elif isinstance(dtype, pd.CategoricalDtype):
-                df[column] = df[column].astype(str)
-
-            elif pd.api.types.is_object_dtype(dtype):
-                # Handle lists, dicts, sets, tuples
-                if isinstance(sample_value, (list, dict, set, tuple)):
-                    df[column] = df[column].apply(lambda x: str(x) if x is not None else None)
-
-                # Convert to datetime if applicable
-                try:
-                    converted_col = pd.to_datetime(df[column], format="%Y-%m-%d %H:%M:%S", errors='coerce')
-                    if converted_col.notna().sum() > 0:  # Check if valid datetime values exist
-                        df[column] = converted_col.dt.strftime('%Y-%m-%d %H:%M:%S')
-                    else:
-                        df[column] = df[column].astype(str)  # Keep as string if all conversions failed
-                except Exception:
-                    df[column] = df[column].astype(str)
-
-            elif pd.api.types.is_datetime64_dtype(dtype):
-                df[column] = df[column].dt.strftime('%Y-%m-%d %H:%M:%S')
-
-            elif pd.api.types.is_timedelta64_dtype(dtype):
-                df[column] = df[column].apply(lambda x: str(x.total_seconds()) if pd.notnull(x) else None)
-
-            elif pd.api.types.is_bool_dtype(dtype):
-                # MySQL uses TINYINT(1) for boolean
-                pass
-
-            elif pd.api.types.is_integer_dtype(dtype):
-                pass  # Keep integer as is
-
+                converter = _convert_to_string
+            elif pd.api.types.is_float_dtype(dtype):
+                converter = _convert_float  # Nullable Float64
+            elif pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+                converter = _keep_as_is  # Nullable boolean/Int64
             else:
-                df[column] = df[column].astype(str)
+                converter = _convert_to_string
+            converter(df, column, sample_value)
 
         except Exception as e:
             print(f"Warning: Error converting column {column}. Converting to string. Error: {str(e)}")
@@ -79,15 +153,19 @@ def safe_convert_for_mysql(df):
     return df
 
 
-def get_mysql_type(pandas_dtype, column_values):
+def get_mysql_type(pandas_dtype, column_values, streamed=False):
     """
     Map pandas dtypes to MySQL data types.
+    With streamed=True column_values are only the first chunk of the data, so
+    integer and text columns get the widest type instead of one sized to them.
     """
     if pd.api.types.is_datetime64_dtype(pandas_dtype):
         return "DATETIME"
     elif pd.api.types.is_bool_dtype(pandas_dtype):
         return "TINYINT(1)"
     elif pd.api.types.is_integer_dtype(pandas_dtype):
+        if streamed:
+            return "BIGINT"
         max_val = column_values.max() if not column_values.empty else 0
         # Choose appropriate integer type based on size
         if max_val <= 127:
@@ -102,11 +180,14 @@ def get_mysql_type(pandas_dtype, column_values):
             return "BIGINT"
     elif pd.api.types.is_float_dtype(pandas_dtype):
         return "DOUBLE"
+    elif streamed:
+        return "LONGTEXT"
     else:
         # For strings, determine max length to choose VARCHAR or TEXT
         non_null_values = column_values.dropna()
         if len(non_null_values) > 0:
-            max_length = non_null_values.astype(str).str.len().max()
+            # Single pass over the raw values, no intermediate string Series
+            max_length = max(map(len, map(str, non_null_values.to_numpy())))
             if max_length <= 65535:
                 return "TEXT"
             elif max_length <= 16777215:
@@ -116,6 +197,13 @@ def get_mysql_type(pandas_dtype, column_values):
         return "VARCHAR(255)"  # Default
 
 
+def sanitize_name(name):
+    """
+    Replace characters MySQL doesn't accept in table/column names with underscores.
+    """
+    return name.translate(IDENTIFIER_TRANSLATION)
+
+
 def create_mysql_connection():
     """
     Create and return a MySQL connection.
@@ -129,23 +217,174 @@ def create_mysql_connection():
         return None
 
 
-def insert_database(table_name, data_frame):
+def prepare_data_frame(data_frame, column_dtypes=None):
     """
-    Insert dataframe into MySQL table with dynamic schema creation.
+    Drop unnamed columns, sanitize column names and convert the rest to
+    MySQL-compatible types.
+    Later chunks of a chunked load pass the first chunk's converted column_dtypes.
     """
-    try:
-        # Create a copy to avoid modifying the original DataFrame
-        df = data_frame.copy()
+    # Clean unnamed columns with a plain boolean mask (no regex engine).
+    # Copy-on-write keeps later column assignments off the original DataFrame
+    # without copying it up front.
+    keep = ['unnamed' not in str(col).lower() for col in data_frame.columns]
+    df = data_frame.loc[:, keep]
+
+    # Sanitize column names once; every later step uses them as-is
+    df.columns = [sanitize_name(col) for col in df.columns]
+
+    # Convert all columns to MySQL-compatible types
+    return safe_convert_for_mysql(df, column_dtypes)
+
 
-        # Clean unnamed columns
-        df.drop(
-            df.columns[df.columns.str.contains('unnamed', case=False)],
-            axis=1, inplace=True
+def ensure_schema(connection, cursor, table_name, df, streamed=False):
+    """
+    Create the table from the DataFrame's schema, or add any columns it is missing.
+    Pass streamed=True when df is only the first chunk of the rows to load.
+    Safe to run for the same table from several connections at once.
+    """
+    # Check if table exists
+    cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
+    table_exists = cursor.fetchone()
+
+    if not table_exists:
+        # Create table with schema
+        column_definitions = []
+        for col in df.columns:
+            mysql_type = get_mysql_type(df[col].dtype, df[col], streamed)
+            column_definitions.append(f"`{col}` {mysql_type}")
+
+        # Add an auto-incrementing ID column and created_at timestamp.
+        # IF NOT EXISTS lets a concurrent import create the table first.
+        create_table_sql = f"""
+        CREATE TABLE IF NOT EXISTS `{table_name}` (
+            `id` INT AUTO_INCREMENT PRIMARY KEY,
+            {', '.join(column_definitions)},
+            `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
+        """
+        cursor.execute(create_table_sql)
+        connection.commit()
+
+    # Check if we need to add new columns, including to a table a concurrent
+    # import just created from another file
+    cursor.execute(f"DESCRIBE `{table_name}`")
+    existing_columns = {row[0] for row in cursor.fetchall()}
+
+    for col in df.columns:
+        if col not in existing_columns and col != 'id' and col != 'created_at':
+            mysql_type = get_mysql_type(df[col].dtype, df[col], streamed)
+            alter_table_sql = f"ALTER TABLE `{table_name}` ADD COLUMN `{col}` {mysql_type}"
+            try:
+                cursor.execute(alter_table_sql)
+            except Error as e:
+                if e.errno != DUPLICATE_COLUMN_ERRNO:
+                    raise
+            connection.commit()
 
-        # Convert all columns to MySQL-compatible types
-        df = safe_convert_for_mysql(df)
 
+def _to_infile_text(df):
+    """
+    Render DataFrame rows as tab-separated lines in MySQL's default LOAD DATA format.
+    """
+    fields = []
+    for column in df.columns:
+        col = df[column]
+        if pd.api.types.is_bool_dtype(col.dtype):
+            col = col.astype('Int8')  # TINYINT(1) expects 0/1, not True/False
+        text = (
+            col.astype(str)
+            .str.replace('\\', '\\\\', regex=False)
+            .str.replace('\t', '\\t', regex=False)
+            .str.replace('\n', '\\n', regex=False)
+            .str.replace('\r', '\\r', regex=False)
+        )
+        fields.append(text.where(col.notna(), '\\N'))  # \N is read back as NULL
+
+    lines = fields[0].str.cat(fields[1:], sep='\t') if len(fields) > 1 else fields[0]
+    return '\n'.join(lines) + '\n'
+
+
+def load_rows_from_file(cursor, table_name, df):
+    """
+    Bulk load DataFrame rows with LOAD DATA LOCAL INFILE via a temporary file.
+    """
+    columns_str = ', '.join([f'`{col}`' for col in df.columns])
+
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', encoding='utf-8', newline='', delete=False) as infile:
+        infile.write(_to_infile_text(df))
+    try:
+        infile_path = infile.name.replace('\\', '/')
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE '{infile_path}' INTO TABLE `{table_name}` "
+            f"CHARACTER SET utf8mb4 "
+            f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+            f"({columns_str})"
+        )
+
+        # LOCAL downgrades conversion errors (truncation, out of range) to
+        # warnings, so treat any warning as a failure and let the load roll back
+        warning_count = cursor.warning_count
+        if warning_count:
+            cursor.execute("SHOW WARNINGS LIMIT 5")
+            details = '; '.join(f"{level} {code}: {message}" for level, code, message in cursor.fetchall())
+            raise Error(msg=f"LOAD DATA into {table_name} produced {warning_count} warning(s): {details}")
+    finally:
+        os.remove(infile.name)
+
+
+def append_rows(cursor, table_name, df):
+    """
+    Insert DataFrame rows into an existing MySQL table, preferring LOAD DATA LOCAL INFILE
+    and falling back to batched INSERTs when local infile is disabled.
+    The caller owns the transaction and commits once the whole load is done.
+    """
+    if len(df) == 0:
+        return
+    try:
+        load_rows_from_file(cursor, table_name, df)
+    except Error as e:
+        if e.errno not in LOCAL_INFILE_REJECTED_ERRNOS:
+            raise
+        print(f"LOAD DATA LOCAL INFILE not permitted, using batched INSERT. Error: {str(e)}")
+        insert_rows_batched(cursor, table_name, df)
+
+
+def insert_rows_batched(cursor, table_name, df):
+    """
+    Insert DataFrame rows into an existing MySQL table in batches.
+    """
+    # Columns are fixed for the whole load, so build the insert query once
+    placeholders = ', '.join(['%s'] * len(df.columns))
+    columns_str = ', '.join([f'`{col}`' for col in df.columns])
+    insert_sql = f"INSERT INTO `{table_name}` ({columns_str}) VALUES ({placeholders})"
+
+    # Pull each column out once as an object array of Python values, with
+    # missing values as None so the connector binds them as NULL
+    column_arrays = [
+        df[col].astype(object).where(df[col].notna(), None).to_numpy()
+        for col in df.columns
+    ]
+
+    batch_size = 1000  # Adjust based on your needs
+    for start_idx in range(0, len(df), batch_size):
+        end_idx = min(start_idx + batch_size, len(df))
+
+        # Prepare data for insertion by zipping array views into row tuples
+        data_values = list(zip(*(values[start_idx:end_idx] for values in column_arrays)))
+
+        # Execute insert
+        cursor.executemany(insert_sql, data_values)
+
+
+def insert_chunks(table_name, chunks, streamed=False):
+    """
+    Insert an iterable of DataFrame chunks into one MySQL table.
+    The schema is created (or extended) from the first chunk, later chunks are
+    cast to its dtypes, and the whole load is rolled back if any chunk fails.
+    Pass streamed=True when chunks is a file read in pieces, so columns aren't
+    sized from the first chunk alone.
+    """
+    try:
         # Create MySQL connection
         connection = create_mysql_connection()
         if not connection:
@@ -153,70 +392,33 @@ def insert_database(table_name, data_frame):
 
         cursor = connection.cursor()
 
-        # Check if table exists
-        cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
-        table_exists = cursor.fetchone()
-
-        if not table_exists:
-            # Create table with schema
-            column_definitions = []
-            for col in df.columns:
-                mysql_type = get_mysql_type(df[col].dtype, df[col])
-                # MySQL doesn't like certain characters in column names
-                col_name = col.replace(' ', '_').replace('-', '_').replace('.', '_')
-                column_definitions.append(f"`{col_name}` {mysql_type}")
-
-            # Add an auto-incrementing ID column and created_at timestamp
-            create_table_sql = f"""
-            CREATE TABLE `{table_name}` (
-                `id` INT AUTO_INCREMENT PRIMARY KEY,
-                {', '.join(column_definitions)},
-                `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """
-            cursor.execute(create_table_sql)
-            connection.commit()
-        else:
-            # Table exists, check if we need to add new columns
-            cursor.execute(f"DESCRIBE `{table_name}`")
-            existing_columns = {row[0] for row in cursor.fetchall()}
-            
-            for col in df.columns:
-                # MySQL doesn't like certain characters in column names
-                col_name = col.replace(' ', '_').replace('-', '_').replace('.', '_')
-                if col_name not in existing_columns and col_name != 'id' and col_name != 'created_at':
-                    mysql_type = get_mysql_type(df[col].dtype, df[col])
-                    alter_table_sql = f"ALTER TABLE `{table_name}` ADD COLUMN `{col_name}` {mysql_type}"
-                    cursor.execute(alter_table_sql)
-                    connection.commit()
-
-        # Fetch the current max ID
-        cursor.execute(f"SELECT IFNULL(MAX(id), 0) FROM `{table_name}`")
-        max_id = cursor.fetchone()[0]  # Extract the max id
-        
-        # Insert data in batches
-        batch_size = 1000  # Adjust based on your needs
-        for start_idx in range(0, len(df), batch_size):
-            end_idx = min(start_idx + batch_size, len(df))
-            batch_df = df.iloc[start_idx:end_idx]
-            
-            # Generate placeholders and values for the insert query
-            placeholders = ', '.join(['%s'] * len(batch_df.columns))
-            columns = [col.replace(' ', '_').replace('-', '_').replace('.', '_') for col in batch_df.columns]
-            columns_str = ', '.join([f'`{col}`' for col in columns])
-            
-            insert_sql = f"INSERT INTO `{table_name}` ({columns_str}) VALUES ({placeholders})"
-            
-            # Prepare data for insertion
-            data_values = [tuple(row) for row in batch_df.values]
-            
-            # Execute insert
-            cursor.executemany(insert_sql, data_values)
+        total_rows = 0
+        try:
+            for chunk_idx, chunk in enumerate(chunks):
+                if chunk_idx == 0:
+                    # Later chunks are read back to the source dtypes, converted the
+                    # same way and cast to the converted dtypes the schema is built from
+                    source_dtypes = chunk.dtypes.to_dict()
+                    df = prepare_data_frame(chunk)
+                    column_dtypes = df.dtypes.to_dict()
+                    # DDL commits implicitly, so the schema is settled before any rows load
+                    ensure_schema(connection, cursor, table_name, df, streamed)
+                else:
+                    df = prepare_data_frame(cast_chunk(chunk, source_dtypes), column_dtypes)
+                    df = conform_chunk(df, column_dtypes)
+                append_rows(cursor, table_name, df)
+                total_rows += len(df)
+
+            # Commit the whole load in one transaction (one fsync) instead of per batch
             connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+            connection.close()
 
-        cursor.close()
-        connection.close()
-        return f"Successfully inserted {len(df)} rows into {table_name}"
+        return f"Successfully inserted {total_rows} rows into {table_name}"
 
     except Error as e:
         print(f"MySQL Error: {str(e)}")
@@ -226,6 +428,22 @@ def insert_database(table_name, data_frame):
         return str(e)
 
 
+def insert_database(table_name, data_frame):
+    """
+    Insert dataframe into MySQL table with dynamic schema creation.
+    """
+    return insert_chunks(table_name, [data_frame])
+
+
+def import_file(table_name, file_path, chunks, streamed=False):
+    """
+    Import one file's chunks into a MySQL table, reporting progress.
+    """
+    print(f"Processing {file_path} into table {table_name}...")
+    result = insert_chunks(table_name, chunks, streamed)
+    print(result)
+
+
 # Read Excel file
 print("Current Working Directory:", os.getcwd())
 
@@ -234,15 +452,14 @@ def batch_excel_to_mysql(excel_files):
     Batch import Excel files to MySQL.
     """
     try:
+        jobs = []
         for excel_file in excel_files:
             table_name = os.path.splitext(excel_file)[0].replace('.xlsx', '')
             # Clean table name for MySQL (remove invalid characters)
-            table_name = table_name.replace('.', '_').replace('-', '_').replace(' ', '_')
+            table_name = sanitize_name(table_name)
             
-            print(f"Processing {excel_file} into table {table_name}...")
-            data_frame = pd.read_excel(excel_file)
-            result = insert_database(table_name, data_frame)
-            print(result)
+            jobs.append((table_name, excel_file, read_excel_chunks(excel_file)))
+        import_files(jobs, import_file, MAX_IMPORT_WORKERS)
     except Exception as e:
         print(f"Error in batch Excel import: {e}")
         
@@ -253,6 +470,7 @@ def batch_csv_to_mysql(csv_files):
     Batch import CSV files to MySQL with facility name.
     """
     try:
+        jobs = []
         for csv_file in csv_files:
             table_name = 'payout_summary'
             # csv_name = os.path.splitext(csv_file)[0].replace('.csv', '')
@@ -262,10 +480,13 @@ def batch_csv_to_mysql(csv_files):
             #     facility_name = 'Gateway'
             
             # print(f"Processing {csv_file} with facility {facility_name}...")
-            data_frame = pd.read_csv(csv_file)
-            # data_frame['facility_name'] = facility_name
-            result = insert_database(table_name, data_frame)
-            print(result)
+            chunks = read_csv_chunks(csv_file, READ_CHUNK_SIZE)
+            # chunks = read_csv_chunks(csv_file, READ_CHUNK_SIZE, facility_name=facility_name)
+            jobs.append((table_name, csv_file, chunks))
+        # Every file lands in the same table, but AUTO_INCREMENT ids and a
+        # transaction per connection let MySQL take them in parallel
+        import_files(jobs, functools.partial(import_file, streamed=True),
+                     MAX_IMPORT_WORKERS, serialize_tables=False)
     except Exception as e:
         print(f"Error in batch CSV import: {e}")
 